@@ -0,0 +1,22 @@
+"""Decode HTML entities in a saved MQS page dump.
+
+The MQS pages escape the Chinese stop and route names; this rewrites a
+saved dump with the entities decoded so it can be read directly.
+"""
+
+import html
+import sys
+
+
+def decode_file(in_path, out_path):
+    # Entities never contain a newline, so decoding line by line is
+    # safe and keeps memory flat regardless of dump size.
+    with open(in_path, encoding="utf-8") as src, open(
+        out_path, "w", encoding="utf-8"
+    ) as dst:
+        for line in src:
+            dst.write(html.unescape(line))
+
+
+if __name__ == "__main__":
+    decode_file(sys.argv[1], sys.argv[2])
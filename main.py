@@ -0,0 +1,266 @@
+"""Taipei bus arrival scraper.
+
+Pulls the static route/direction table and the real-time arrival
+estimates for a stop from the Taipei MQS site (pda5284.gov.taipei)
+and merges them into a list of ``BusArrival`` records. The stop name
+to slid (stop location id) mapping comes from ``stop_to_slid.json``,
+which is produced by the conversion helper in ``test.py``.
+"""
+
+import functools
+import html
+import json
+from bisect import bisect_right
+import os
+import re
+import time
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
+
+import lxml.html
+import requests
+from requests.adapters import HTTPAdapter
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+try:
+    import requests_cache
+except ImportError:
+    requests_cache = None
+
+# orjson decodes the CJK-heavy stopdyna payloads several times faster
+# than the stdlib; fall back transparently when it is not installed.
+_json_loads = orjson.loads if orjson is not None else json.loads
+
+BASE_URL = "https://pda5284.gov.taipei/MQS"
+STOP_MAPPING_FILE = os.path.join(os.path.dirname(__file__), "stop_to_slid.json")
+
+# The MQS pages are utf-8 but do not always say so; pin the encoding
+# at the parser instead of trusting the server or the document.
+_UTF8_PARSER = lxml.html.HTMLParser(encoding="utf-8")
+
+# Only the route rows are ever consumed; select them (and their cells)
+# straight off the lxml tree instead of walking it.
+_ROUTE_ROW_XPATH = '//tr[@class="ttego1" or @class="ttego2"]'
+_ROUTE_LINK_XPATH = ".//a"
+
+# The row's 4th <td> carries the stop's dynamic id as a "tte"-prefixed
+# attribute value; the stopdyna entries reference the same id.
+_DYNAMIC_ID_RE = re.compile(r"tte(\d+)")
+
+# Decoration stripped from the UpdateTime field, compiled once instead
+# of a replace chain re-scanning the string per poll. The field arrives
+# with its colons as raw &#x3a; entities, so it is html.unescape'd
+# before the junk strip.
+_UPDATE_TIME_JUNK_RE = re.compile(r"更新時間:|※")
+
+# Negative arrival times are status codes, not ETAs.
+_STATUS_LABELS = {-1: "未發車", -2: "交管不停", -3: "末班已過", -4: "今日未營運"}
+
+# Non-negative ETA buckets: 0 arriving, under 180s approaching, then
+# minutes. The bucket and the per-minute strings are table lookups
+# rather than a string format and an if/elif ladder per arrival.
+_ETA_BOUNDS = (1, 180)
+_ETA_LABELS = ("進站中", "將到站", None)
+_MINUTE_LABELS = tuple(f"{m}分" for m in range(120))
+
+
+def _format_eta(seconds):
+    """Map an arrival time (or negative status code) to its display text."""
+    if seconds < 0:
+        return _STATUS_LABELS.get(seconds, _STATUS_LABELS[-1])
+    label = _ETA_LABELS[bisect_right(_ETA_BOUNDS, seconds)]
+    if label is not None:
+        return label
+    minutes = seconds // 60
+    return _MINUTE_LABELS[minutes] if minutes < len(_MINUTE_LABELS) else f"{minutes}分"
+
+
+def _parse_stop_entry(entry, route_map):
+    """Turn one stopdyna entry into a BusArrival, or None if malformed.
+
+    Module-level so the per-entry hot loop runs on local and global
+    lookups only, with no method dispatch.
+    """
+    # n1 is a comma record of 8+ fields with the dynamic tte id at
+    # index 1 and the arrival time at index 7; cap the split one past
+    # the last consumed field so any tail stays merged in index 8.
+    n1_parts = entry.get("n1", "").split(",", 8)
+    if len(n1_parts) < 8:
+        return None
+    match = _DYNAMIC_ID_RE.search(n1_parts[1])
+    route_id = match.group(1) if match else ""
+    try:
+        seconds = int(n1_parts[7])
+    except ValueError:
+        seconds = -1
+    name, direction = route_map.get(route_id, (n1_parts[0], ""))
+    return BusArrival(name, direction, seconds, _format_eta(seconds))
+
+
+def _eta_sort_key(arrival):
+    """Sort key pushing not-yet-departed buses (negative ETA) to the end."""
+    return arrival.estimate_seconds if arrival.estimate_seconds >= 0 else 1 << 30
+
+# The route table per stop only changes with timetable updates, so a
+# polling client can keep it for an hour and re-fetch only the dynamic
+# JSON in between.
+ROUTE_CACHE_TTL = 3600
+
+
+@functools.lru_cache(maxsize=4)
+def _load_stop_mapping(mapping_file, mtime):
+    """Parse the stop -> slid mapping, cached across instances.
+
+    Keyed on (path, mtime) so an edited mapping file is picked up on
+    the next construction while repeat constructions skip the file
+    read and JSON decode entirely.
+    """
+    with open(mapping_file, encoding="utf-8") as f:
+        return json.load(f)
+
+
+def load_stop_mapping(mapping_file):
+    path = os.path.abspath(mapping_file)
+    return _load_stop_mapping(path, os.path.getmtime(path))
+
+
+@dataclass(slots=True, frozen=True)
+class BusArrival:
+    route_name: str
+    direction: str
+    estimate_seconds: int
+    estimate_text: str
+
+
+class TaipeiBusAPI:
+    """Client for the MQS stop pages."""
+
+    def __init__(self, mapping_file=STOP_MAPPING_FILE):
+        self.stop_to_slid = load_stop_mapping(mapping_file)
+        # Keep-alive session so repeated calls reuse the TCP+TLS
+        # connection instead of handshaking per request. With
+        # requests-cache installed the static stoplocation.jsp pages
+        # are additionally cached on disk (honoring ETag/Last-Modified
+        # revalidation) so they survive process restarts; the dynamic
+        # endpoint is never cached.
+        if requests_cache is not None:
+            self.session = requests_cache.CachedSession(
+                "mqs_cache",
+                backend="sqlite",
+                expire_after=ROUTE_CACHE_TTL,
+                cache_control=True,
+                urls_expire_after={"*/MQS/stopdyna*": requests_cache.DO_NOT_CACHE},
+            )
+        else:
+            self.session = requests.Session()
+        self.session.mount(
+            "https://", HTTPAdapter(pool_connections=10, pool_maxsize=20)
+        )
+        self._route_cache = {}
+
+    def _fetch_route_info(self, stop_id):
+        """Fetch the static route table for a stop.
+
+        Returns a dict mapping the row's tte id -> (route name,
+        direction). Results are cached per stop for ROUTE_CACHE_TTL
+        seconds.
+        """
+        cached = self._route_cache.get(stop_id)
+        if cached is not None and time.monotonic() - cached[0] < ROUTE_CACHE_TTL:
+            return cached[1]
+        url = f"{BASE_URL}/stoplocation.jsp?slid={stop_id}"
+        response = self.session.get(url, timeout=5)
+        # Hand lxml the raw bytes with the encoding pinned, skipping
+        # requests' Python-level decode pass.
+        tree = lxml.html.fromstring(response.content, parser=_UTF8_PARSER)
+        route_map = {}
+        for row in tree.xpath(_ROUTE_ROW_XPATH):
+            direction = "去程" if row.get("class") == "ttego1" else "返程"
+            cells = row.xpath("./td")
+            links = row.xpath(_ROUTE_LINK_XPATH)
+            if len(cells) < 4 or not links:
+                continue
+            # The tte id lives in one of the 4th cell's attributes.
+            for value in cells[3].values():
+                match = _DYNAMIC_ID_RE.search(value)
+                if match:
+                    route_map[match.group(1)] = (links[0].text_content().strip(), direction)
+                    break
+        self._route_cache[stop_id] = (time.monotonic(), route_map)
+        return route_map
+
+    def _fetch_dynamic_data(self, stop_id):
+        """Fetch the real-time arrival JSON for a stop."""
+        url = f"{BASE_URL}/stopdyna?slid={stop_id}"
+        response = self.session.get(url, timeout=5)
+        return _json_loads(response.content)
+
+    def get_stop_estimates(self, stop_name):
+        """Return the current arrivals for a stop, sorted by ETA."""
+        stop_id = self.stop_to_slid.get(stop_name)
+        if stop_id is None:
+            raise KeyError(f"unknown stop name: {stop_name}")
+        # The two fetches are independent, so overlap their round trips
+        # on the shared session.
+        with ThreadPoolExecutor(max_workers=2) as executor:
+            route_future = executor.submit(self._fetch_route_info, stop_id)
+            dynamic_future = executor.submit(self._fetch_dynamic_data, stop_id)
+            route_map = route_future.result()
+            dynamic = dynamic_future.result()
+        update_time = html.unescape(dynamic.get("UpdateTime", ""))
+        update_time = _UPDATE_TIME_JUNK_RE.sub("", update_time).strip()
+        arrivals = self._process_arrivals(route_map, dynamic)
+        return {"update_time": update_time, "arrivals": arrivals}
+
+    def build_stop_index(self, stop_names=None):
+        """Prefetch route tables into stop name -> (slid, route_map).
+
+        One concurrent sweep at startup fills the route cache for the
+        given stops (all known stops by default), so later polls only
+        pay for the dynamic fetch.
+        """
+        if stop_names is None:
+            stop_names = self.stop_to_slid
+        names = [name for name in stop_names if name in self.stop_to_slid]
+        slids = [self.stop_to_slid[name] for name in names]
+        with ThreadPoolExecutor(max_workers=8) as executor:
+            route_maps = executor.map(self._fetch_route_info, slids)
+            return dict(zip(names, zip(slids, route_maps)))
+
+    def get_stop_estimates_batch(self, stop_names):
+        """Fan out ``get_stop_estimates`` across stops concurrently.
+
+        Returns a dict mapping stop name -> estimates.
+        """
+        stop_names = list(stop_names)
+        with ThreadPoolExecutor(max_workers=8) as executor:
+            results = executor.map(self.get_stop_estimates, stop_names)
+            return dict(zip(stop_names, results))
+
+    def _process_arrivals(self, route_map, dynamic):
+        arrivals = [
+            arrival
+            for arrival in (
+                _parse_stop_entry(entry, route_map) for entry in dynamic.get("Stop", [])
+            )
+            if arrival is not None
+        ]
+        arrivals.sort(key=_eta_sort_key)
+        return arrivals
+
+
+def main():
+    api = TaipeiBusAPI()
+    for stop_name in ("捷運市政府站", "世貿中心"):
+        result = api.get_stop_estimates(stop_name)
+        print(f"=== {stop_name} ({result['update_time']}) ===")
+        for arrival in result["arrivals"]:
+            print(f"{arrival.route_name} [{arrival.direction}] {arrival.estimate_text}")
+
+
+if __name__ == "__main__":
+    main()
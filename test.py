@@ -0,0 +1,39 @@
+"""Scratch helpers used while building stop_to_slid.json.
+
+The scraping loop below was used to sanity-check the MQS pages by hand;
+the CSV conversion at the bottom turns the exported stop list into the
+stop_to_slid.json mapping that main.py loads.
+"""
+
+import csv
+import json
+
+# import requests
+# from bs4 import BeautifulSoup
+#
+# session = requests.Session()
+# for slid in range(1000, 1010):
+#     url = f"https://pda5284.gov.taipei/MQS/stoplocation.jsp?slid={slid}"
+#     response = session.get(url, timeout=5)
+#     response.encoding = "utf-8"
+#     soup = BeautifulSoup(response.text, "lxml")
+#     for row in soup.find_all("tr", class_=["ttego1", "ttego2"]):
+#         # find() scopes to the row already; no need to serialize the
+#         # row back to a string and parse it a second time
+#         link = row.find("a")
+#         if link:
+#             print(slid, link.text.strip(), link.get("href"))
+
+
+def convert_csv_to_json(csv_path="stops.csv", json_path="stop_to_slid.json"):
+    """Convert the exported stop list CSV into the name -> slid mapping."""
+    with open(csv_path, encoding="utf-8", newline="") as f:
+        reader = csv.reader(f)
+        mapping = {row[0]: row[1] for row in reader if row and row[0] != "name"}
+    with open(json_path, "w", encoding="utf-8") as f:
+        json.dump(mapping, f, ensure_ascii=False, indent=2)
+    return mapping
+
+
+if __name__ == "__main__":
+    convert_csv_to_json()